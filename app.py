@@ -1,13 +1,27 @@
 import asyncio
+import atexit
+import glob
+import hashlib
+import hmac
 import json
 import logging
 import os
+import queue
+import re
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import aclosing, contextmanager
 from datetime import datetime
-from logging.handlers import TimedRotatingFileHandler
-from typing import Any, Dict, List, AsyncGenerator
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, Dict, List, Optional, Set, AsyncGenerator
 import time
 
+import bcrypt
+import cachetools
+import chromadb
+import numpy as np
+import pymupdf
 from chromadb.config import Settings
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
@@ -16,7 +30,8 @@ from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from pydantic import BaseModel
 import httpx
@@ -39,17 +54,37 @@ def setup_logger():
     )
     handler.setFormatter(formatter)
 
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    # Log calls only enqueue records; a background thread does the file/console I/O
+    log_queue = queue.Queue(-1)
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    listener = QueueListener(log_queue, handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Flush queued records on any interpreter exit, not just FastAPI shutdown
+    atexit.register(listener.stop)
 
 setup_logger()
 logger = logging.getLogger(__name__)
 
+# ───────────────────────────────────────────────
+# Timestamps
+# ───────────────────────────────────────────────
+
+_ts_cache = {"sec": None, "str": ""}
+
+def fast_iso() -> str:
+    """Local ISO-8601 timestamp at second resolution, reformatted only when the second changes"""
+    sec = int(time.time())
+    if sec != _ts_cache["sec"]:
+        _ts_cache["str"] = datetime.fromtimestamp(sec).isoformat()
+        _ts_cache["sec"] = sec
+    return _ts_cache["str"]
+
 # ───────────────────────────────────────────────
 # Environment
 # ───────────────────────────────────────────────
@@ -62,6 +97,25 @@ if not openai_api_key:
 
 print("OPENAI API key loaded:", openai_api_key[:10], "****")
 
+COLLECTION_NAME = "langchain"
+
+# HNSW index tuning for the Chroma collection, overridable without code changes
+HNSW_METADATA = {
+    "hnsw:space": os.getenv("CHROMA_HNSW_SPACE", "cosine"),
+    "hnsw:M": int(os.getenv("CHROMA_HNSW_M", "32")),
+    "hnsw:construction_ef": int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "200")),
+    "hnsw:search_ef": int(os.getenv("CHROMA_HNSW_SEARCH_EF", "64")),
+}
+
+# ───────────────────────────────────────────────
+# Shared HTTP Clients
+# ───────────────────────────────────────────────
+
+# Reuse keep-alive HTTP/2 connections to the OpenAI API across all requests
+http_limits = httpx.Limits(max_keepalive_connections=32, max_connections=100)
+http_client = httpx.Client(http2=True, timeout=30, limits=http_limits)
+http_async_client = httpx.AsyncClient(http2=True, timeout=30, limits=http_limits)
+
 # ───────────────────────────────────────────────
 # FastAPI App
 # ───────────────────────────────────────────────
@@ -78,7 +132,7 @@ app.add_middleware(
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-active_connections: List[WebSocket] = []
+active_connections: Set[WebSocket] = set()
 user_sessions: Dict[str, Any] = {}
 
 # ───────────────────────────────────────────────
@@ -86,12 +140,17 @@ user_sessions: Dict[str, Any] = {}
 # ───────────────────────────────────────────────
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "budger_users.db"):
+    def __init__(self, db_path: str = "budger_users.db", pool_size: int = 4):
         self.db_path = db_path
         self._initialize_db()
+        self._pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._create_connection())
     
     def _initialize_db(self):
         conn = sqlite3.connect(self.db_path)
+        # WAL is persisted in the database file, so it only needs setting once
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -112,16 +171,77 @@ class DatabaseManager:
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_user_sess
+            ON chat_history (user_id, session_id, timestamp DESC)
+        """)
         conn.commit()
         conn.close()
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def _create_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
         return conn
 
+    @contextmanager
+    def get_connection(self):
+        """Borrow a pooled connection, returning it to the pool afterwards"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    def close(self):
+        """Close all pooled connections"""
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
 db_manager = DatabaseManager()
 
+# ───────────────────────────────────────────────
+# Password Hashing
+# ───────────────────────────────────────────────
+
+# bcrypt only accepts passwords up to 72 bytes
+MAX_PASSWORD_BYTES = 72
+BCRYPT_HASH_RE = re.compile(r"^\$2[abxy]\$\d{2}\$[./A-Za-z0-9]{53}$")
+
+# Checked against when there is no bcrypt hash, so failed logins take the same time
+_DUMMY_HASH = bcrypt.hashpw(b"budger-dummy-password", bcrypt.gensalt(rounds=12))
+
+def password_too_long(password: str) -> bool:
+    return len(password.encode()) > MAX_PASSWORD_BYTES
+
+def is_bcrypt_hash(stored: str) -> bool:
+    return BCRYPT_HASH_RE.match(stored) is not None
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """Check a password against a bcrypt hash, or a legacy plaintext value.
+
+    Always costs one bcrypt check, so timing does not reveal whether the account exists.
+    """
+    if password_too_long(password):
+        return False
+    candidate = password.encode()
+    if stored is not None and is_bcrypt_hash(stored):
+        try:
+            return bcrypt.checkpw(candidate, stored.encode())
+        except ValueError:
+            return False
+    bcrypt.checkpw(candidate, _DUMMY_HASH)
+    if stored is None:
+        return False
+    return hmac.compare_digest(candidate, stored.encode())
+
 # ───────────────────────────────────────────────
 # Pydantic Models
 # ───────────────────────────────────────────────
@@ -152,24 +272,155 @@ class LoginRequest(BaseModel):
     login_id: str
     password: str
 
+# ───────────────────────────────────────────────
+# Cached Query Embeddings
+# ───────────────────────────────────────────────
+
+class CachedEmbeddings(Embeddings):
+    """LRU cache in front of an embeddings model for repeated query strings"""
+
+    def __init__(self, embeddings: Embeddings, max_size: int = 10_000):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+            return vector
+
+    def _store(self, key, vector: List[float]):
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model_name, text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = (self.model_name, text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._store(key, vector)
+        return vector
+
+# ───────────────────────────────────────────────
+# Maximal Marginal Relevance
+# ───────────────────────────────────────────────
+
+def maximal_marginal_relevance(
+    query_embedding, embeddings, k: int = 3, lambda_mult: float = 0.5
+) -> List[int]:
+    """Pick k diverse, relevant candidates; all similarities are computed once up front"""
+    embs = np.asarray(embeddings, dtype=np.float32)
+    if embs.ndim != 2 or embs.shape[0] == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+
+    embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    query_sims = embs @ query
+    pair_sims = embs @ embs.T
+
+    first = int(np.argmax(query_sims))
+    selected = [first]
+    available = np.ones(embs.shape[0], dtype=bool)
+    available[first] = False
+    redundancy = pair_sims[first].copy()
+
+    while len(selected) < min(k, embs.shape[0]):
+        scores = lambda_mult * query_sims - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(redundancy, pair_sims[idx], out=redundancy)
+
+    return selected
+
+# ───────────────────────────────────────────────
+# Prompt Templates
+# ───────────────────────────────────────────────
+
+# Enhanced system prompt for Budger, pre-split around the per-request fields
+STREAM_SYS_PREFIX = """You are Budger, an advanced AI customer service agent for Cogent Infotech Corporation. You are helpful, professional, and knowledgeable about the company's services and policies.
+
+Key Guidelines:
+- Provide accurate, helpful responses based on the context provided
+- Be conversational and friendly while maintaining professionalism
+- If you don't know something, admit it rather than guessing
+- Keep responses concise but comprehensive
+- Use the conversation history to maintain context
+
+Previous Conversation:
+"""
+
+RESPONSE_SYS_PREFIX = """You are Budger, an advanced AI customer service agent for Cogent Infotech Corporation. You are helpful, professional, and knowledgeable about the company's services and policies.
+
+Previous Conversation:
+"""
+
+SYS_MID = "\n\nRelevant Context:\n"
+SYS_SUFFIX = "\n\nCurrent User Query: "
+SYS_TAIL = "\n\nPlease provide a helpful and accurate response:"
+
+def build_prompt(prefix: str, recent_history: List[Dict], context_texts: List[str], query: str) -> str:
+    """Assemble the LLM prompt from history, retrieved context and the user query"""
+    context = "\n\n".join(context_texts) if context_texts else "No relevant context found."
+    
+    # Build conversation context
+    conversation_context = "\n\n".join(
+        f"User: {item['user']}\nAssistant: {item['assistant']}" for item in recent_history
+    )
+    
+    return "".join([prefix, conversation_context, SYS_MID, context, SYS_SUFFIX, query, SYS_TAIL])
+
 # ───────────────────────────────────────────────
 # Optimized RAG System with GPT-3.5 Turbo
 # ───────────────────────────────────────────────
 
 class OptimizedRAGSystem:
+    MAX_SESSIONS = 10_000
+
     def __init__(self):
         self.persist_dir = "enhanced_chroma_store"
-        # Use OpenAI embeddings
-        self.embeddings = OpenAIEmbeddings()
+        # Use OpenAI embeddings, caching repeated query vectors
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings(
+            http_client=http_client,
+            http_async_client=http_async_client
+        ))
         # Use OpenAI LLM
         self.llm = ChatOpenAI(
             model_name="gpt-3.5-turbo",
             temperature=0.7,
-            streaming=True
+            streaming=True,
+            http_client=http_client,
+            http_async_client=http_async_client
         )
+        self.chroma_client = None
+        self.collection = None
         self.vectorstore = None
-        self.retriever = None
-        self.conversation_histories = {}
+        self.conversation_histories: OrderedDict = OrderedDict()
+        self._retrieval_cache = cachetools.TTLCache(maxsize=4096, ttl=300)
+        self.ready = False
         self.setup_vectorstore()
         self.log_vectorstore_stats()
 
@@ -180,22 +431,30 @@ class OptimizedRAGSystem:
                 anonymized_telemetry=False,
                 allow_reset=True
             )
+            self.chroma_client = chromadb.PersistentClient(
+                path=self.persist_dir,
+                settings=client_settings
+            )
             self.vectorstore = Chroma(
-                persist_directory=self.persist_dir,
+                client=self.chroma_client,
+                collection_name=COLLECTION_NAME,
                 embedding_function=self.embeddings,
-                client_settings=client_settings
-            )
-            self.retriever = self.vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 3}
+                collection_metadata=HNSW_METADATA
             )
         except Exception as e:
             logger.error(f"Error setting up vectorstore: {str(e)}")
+            self.chroma_client = chromadb.PersistentClient(path=self.persist_dir)
             self.vectorstore = Chroma(
-                persist_directory=self.persist_dir,
-                embedding_function=self.embeddings
+                client=self.chroma_client,
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.embeddings,
+                collection_metadata=HNSW_METADATA
             )
-            self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": 3})
+        # Native collection handle for retrieval, bypassing the LangChain wrapper
+        self.collection = self.chroma_client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata=HNSW_METADATA
+        )
 
     def log_vectorstore_stats(self):
         """Log statistics about the vectorstore"""
@@ -212,43 +471,91 @@ class OptimizedRAGSystem:
         """Async document addition for better performance"""
         try:
             if file_path.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
+                pdf_paths = [file_path]
             else:
-                loader = DirectoryLoader(file_path, glob="**/*.pdf")
-            documents = await asyncio.get_event_loop().run_in_executor(
-                None, loader.load
-            )
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=800,
-                chunk_overlap=100,
-                separators=["\n\n", "\n", ". ", " ", ""]
-            )
-            splits = text_splitter.split_documents(documents)
+                if not os.path.isdir(file_path):
+                    raise FileNotFoundError(f"Directory not found: {file_path}")
+                pdf_paths = glob.glob(os.path.join(file_path, "**/*.pdf"), recursive=True)
+                if not pdf_paths:
+                    raise FileNotFoundError(f"No PDF files found in {file_path}")
+            documents = await asyncio.to_thread(self.load_pdfs, pdf_paths)
+            splits = self.split_documents(documents)
             for split in splits:
                 split.metadata["collection"] = collection_name
-                split.metadata["timestamp"] = datetime.now().isoformat()
+                split.metadata["timestamp"] = fast_iso()
             batch_size = 50
-            for i in range(0, len(splits), batch_size):
-                batch = splits[i:i + batch_size]
-                await asyncio.get_event_loop().run_in_executor(
-                    None, self.vectorstore.add_documents, batch
-                )
+            semaphore = asyncio.Semaphore(8)
+
+            async def add_batch(batch):
+                # Embed batches concurrently, bounded to avoid flooding OpenAI
+                async with semaphore:
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self.vectorstore.add_documents, batch
+                    )
+
+            await asyncio.gather(*[
+                add_batch(splits[i:i + batch_size])
+                for i in range(0, len(splits), batch_size)
+            ])
             try:
                 await asyncio.get_event_loop().run_in_executor(
                     None, self.vectorstore.persist
                 )
             except AttributeError:
                 pass
+            # New chunks may change retrieval results
+            self._retrieval_cache.clear()
             logger.info(f"Added {len(splits)} document chunks to collection '{collection_name}'")
             return True
         except Exception as e:
             logger.error(f"Error adding documents: {str(e)}")
             return False
 
+    def load_pdfs(self, pdf_paths: List[str]) -> List[Document]:
+        """Extract one Document per PDF page with PyMuPDF"""
+        documents = []
+        # PyMuPDF is not thread-safe, so pages are read sequentially from a single parse
+        for path in pdf_paths:
+            with pymupdf.open(path) as pdf:
+                for page_number, page in enumerate(pdf):
+                    documents.append(Document(
+                        page_content=page.get_text("text"),
+                        metadata={"source": path, "page": page_number}
+                    ))
+        return documents
+
+    def split_documents(self, documents: List[Document], chunk_size: int = 800, chunk_overlap: int = 100) -> List[Document]:
+        """Split documents into chunks, falling back to fixed-width slices on pathological text"""
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", " ", ""],
+            keep_separator=False
+        )
+        step = chunk_size - chunk_overlap
+        splits = []
+        for doc in documents:
+            try:
+                chunks = text_splitter.split_text(doc.page_content)
+            except RecursionError:
+                logger.warning(f"Falling back to fixed-width split for {doc.metadata.get('source', 'Unknown')}")
+                text = doc.page_content
+                chunks = [text[i:i + chunk_size] for i in range(0, len(text), step)]
+            splits.extend(
+                Document(page_content=chunk, metadata=dict(doc.metadata))
+                for chunk in chunks
+            )
+        return splits
+
     def get_conversation_history(self, session_id: str) -> List[Dict]:
-        """Get conversation history for session"""
+        """Get conversation history for session, marking it most recently used"""
         if session_id not in self.conversation_histories:
             self.conversation_histories[session_id] = []
+            # Evict least recently used sessions to bound memory
+            while len(self.conversation_histories) > self.MAX_SESSIONS:
+                self.conversation_histories.popitem(last=False)
+        else:
+            self.conversation_histories.move_to_end(session_id)
         return self.conversation_histories[session_id]
 
     def update_conversation_history(self, session_id: str, user_query: str, ai_response: str):
@@ -257,35 +564,72 @@ class OptimizedRAGSystem:
         history.append({
             "user": user_query,
             "assistant": ai_response,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": fast_iso()
         })
         
         # Keep only last 10 exchanges for performance
         if len(history) > 10:
             self.conversation_histories[session_id] = history[-10:]
 
-    async def get_context_documents(self, query: str) -> tuple[List[str], List[str]]:
-        """Retrieve relevant documents asynchronously"""
+    async def get_context_documents(self, query: str, k: int = 3, fetch_k: int = 10) -> tuple[List[str], List[str]]:
+        """Retrieve relevant documents asynchronously using MMR over native Chroma results"""
         try:
-            if self.vectorstore is None:
+            if self.collection is None:
                 logger.error("Vectorstore is not initialized!")
                 return [], []
-            docs = await asyncio.get_event_loop().run_in_executor(
-                None, self.retriever.get_relevant_documents, query
+            normalized = query.strip().lower()
+            cache_key = (hashlib.blake2b(normalized.encode()).digest(), k, fetch_k)
+            cached = self._retrieval_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            query_embedding = await self.embeddings.aembed_query(query)
+            results = await asyncio.get_event_loop().run_in_executor(
+                None,
+                lambda: self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=fetch_k,
+                    include=["documents", "metadatas", "embeddings"]
+                )
             )
-            if not docs:
+            documents = results["documents"][0]
+            metadatas = results["metadatas"][0]
+            selected = maximal_marginal_relevance(
+                query_embedding, results["embeddings"][0], k=k
+            )
+            if not selected:
                 logger.warning("No relevant documents found for query.")
             context_texts = []
             sources = []
-            for doc in docs:
-                context_texts.append(doc.page_content)
-                source_info = f"Page {doc.metadata.get('page', 'N/A')} - {doc.metadata.get('source', 'Unknown')}"
+            for idx in selected:
+                metadata = metadatas[idx] or {}
+                context_texts.append(documents[idx])
+                source_info = f"Page {metadata.get('page', 'N/A')} - {metadata.get('source', 'Unknown')}"
                 sources.append(source_info)
+            self._retrieval_cache[cache_key] = (context_texts, sources)
             return context_texts, sources
         except Exception as e:
             logger.error(f"Error retrieving context: {str(e)}")
             return [], []
 
+    async def warmup(self):
+        """Exercise the embedding, Chroma and LLM paths once so the first real request is not cold"""
+        start_time = time.time()
+        try:
+            # Call the embedder and Chroma directly so a failure reaches the handler below
+            query_embedding = await self.embeddings.aembed_query("warmup")
+            if self.collection is None:
+                logger.warning("Warmup skipped Chroma: vectorstore is not initialized")
+            else:
+                await asyncio.to_thread(
+                    self.collection.query, query_embeddings=[query_embedding], n_results=1
+                )
+            await self.llm.bind(max_tokens=1).ainvoke("ping")
+            logger.info(f"Warmup completed in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            logger.error(f"Warmup failed: {str(e)}")
+        finally:
+            self.ready = True
+
     async def stream_response(self, query: str, session_id: str = "default") -> AsyncGenerator[str, None]:
         """Stream response from gpt-3.5-turbo with enhanced context and conversation history"""
         start_time = time.time()
@@ -296,63 +640,27 @@ class OptimizedRAGSystem:
             
             # Get relevant context
             context_texts, sources = await self.get_context_documents(query)
-            context = "\n\n".join(context_texts) if context_texts else "No relevant context found."
             
-            # Build conversation context
-            conversation_context = ""
-            if history:
-                recent_history = history[-3:]  # Last 3 exchanges
-                for item in recent_history:
-                    conversation_context += f"User: {item['user']}\nAssistant: {item['assistant']}\n\n"
-            
-            # Enhanced system prompt for Budger
-            system_prompt = """You are Budger, an advanced AI customer service agent for Cogent Infotech Corporation. You are helpful, professional, and knowledgeable about the company's services and policies.
-
-Key Guidelines:
-- Provide accurate, helpful responses based on the context provided
-- Be conversational and friendly while maintaining professionalism
-- If you don't know something, admit it rather than guessing
-- Keep responses concise but comprehensive
-- Use the conversation history to maintain context
-
-Previous Conversation:
-{conversation_context}
-
-Relevant Context:
-{context}
-
-Current User Query: {query}
-
-Please provide a helpful and accurate response:"""
-
-            prompt = system_prompt.format(
-                conversation_context=conversation_context,
-                context=context,
-                query=query
+            # Build the prompt off the event loop
+            prompt = await asyncio.to_thread(
+                build_prompt, STREAM_SYS_PREFIX, history[-3:], context_texts, query
             )
             
-            # Stream response from OpenAI
-            response = await self.llm.ainvoke(prompt)
-            full_response = response.content
-
-            # Stream the response word by word for real-time effect
-            words = full_response.split()
-            streamed_response = ""
-            
-            for i, word in enumerate(words):
-                streamed_response += word + " "
+            # Stream tokens from OpenAI as they arrive
+            full_response = ""
+            async for chunk in self.llm.astream(prompt):
+                if not chunk.content:
+                    continue
+                full_response += chunk.content
                 
                 # Send partial response
                 yield json.dumps({
                     "type": "partial",
-                    "content": word + " ",
-                    "full_response": streamed_response.strip(),
+                    "content": chunk.content,
+                    "full_response": full_response,
                     "sources": sources,
                     "session_id": session_id
                 })
-                
-                # Small delay for streaming effect
-                await asyncio.sleep(0.05)
             
             # Update conversation history
             self.update_conversation_history(session_id, query, full_response)
@@ -366,7 +674,7 @@ Please provide a helpful and accurate response:"""
                 "sources": sources,
                 "session_id": session_id,
                 "response_time": response_time,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": fast_iso()
             })
             
         except Exception as e:
@@ -376,7 +684,7 @@ Please provide a helpful and accurate response:"""
                 "content": "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
                 "sources": [],
                 "session_id": session_id,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": fast_iso()
             })
 
     async def get_response(self, query: str, session_id: str = "default") -> Dict[str, Any]:
@@ -389,31 +697,10 @@ Please provide a helpful and accurate response:"""
             
             # Get relevant context
             context_texts, sources = await self.get_context_documents(query)
-            context = "\n\n".join(context_texts) if context_texts else "No relevant context found."
             
-            # Build conversation context
-            conversation_context = ""
-            if history:
-                recent_history = history[-3:]
-                for item in recent_history:
-                    conversation_context += f"User: {item['user']}\nAssistant: {item['assistant']}\n\n"
-            
-            system_prompt = """You are Budger, an advanced AI customer service agent for Cogent Infotech Corporation. You are helpful, professional, and knowledgeable about the company's services and policies.
-
-Previous Conversation:
-{conversation_context}
-
-Relevant Context:
-{context}
-
-Current User Query: {query}
-
-Please provide a helpful and accurate response:"""
-
-            prompt = system_prompt.format(
-                conversation_context=conversation_context,
-                context=context,
-                query=query
+            # Build the prompt off the event loop
+            prompt = await asyncio.to_thread(
+                build_prompt, RESPONSE_SYS_PREFIX, history[-3:], context_texts, query
             )
             
             response = await self.llm.ainvoke(prompt)
@@ -429,7 +716,7 @@ Please provide a helpful and accurate response:"""
                 "response": full_response,
                 "sources": sources,
                 "session_id": session_id,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": fast_iso(),
                 "response_time": response_time
             }
             
@@ -439,7 +726,7 @@ Please provide a helpful and accurate response:"""
                 "response": "I apologize, but I'm experiencing technical difficulties. Please try again in a moment.",
                 "sources": [],
                 "session_id": session_id,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": fast_iso(),
                 "response_time": time.time() - start_time
             }
 
@@ -463,29 +750,40 @@ async def health_check():
     return {
         "status": "healthy",
         "model": "gemini-1.5-flash",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": fast_iso()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe that only reports ready once warmup has finished"""
+    if not rag_system.ready:
+        return JSONResponse(status_code=503, content={"status": "warming up"})
+    return {"status": "ready", "timestamp": fast_iso()}
+
 @app.post("/chat", response_model=QueryResponse)
 async def chat_endpoint(request: QueryRequest):
     """Standard chat endpoint (non-streaming)"""
     result = await rag_system.get_response(query=request.query, session_id=request.session_id)
     
     # Save to database
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (request.session_id, request.session_id))
-    user = cursor.fetchone()
-    
-    if user:
-        cursor.execute(
-            "INSERT INTO chat_history (user_id, session_id, query, response) VALUES (?, ?, ?, ?)",
-            (user["id"], request.session_id, request.query, result["response"])
-        )
-        conn.commit()
+    def save_chat():
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            # UNION lets SQLite use both UNIQUE indexes, unlike an OR predicate
+            cursor.execute(
+                "SELECT id FROM users WHERE username = ? UNION SELECT id FROM users WHERE email = ? LIMIT 1",
+                (request.session_id, request.session_id)
+            )
+            user = cursor.fetchone()
+            
+            if user:
+                cursor.execute(
+                    "INSERT INTO chat_history (user_id, session_id, query, response) VALUES (?, ?, ?, ?)",
+                    (user["id"], request.session_id, request.query, result["response"])
+                )
+                conn.commit()
     
-    conn.close()
+    await asyncio.get_event_loop().run_in_executor(None, save_chat)
     
     return QueryResponse(**result)
 
@@ -496,7 +794,15 @@ async def chat_stream_endpoint(request: QueryRequest):
         async for chunk in rag_system.stream_response(request.query, request.session_id):
             yield f"data: {chunk}\n\n"
     
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Connection": "keep-alive"
+        }
+    )
 
 @app.post("/upload")
 async def upload_document(request: DocumentUploadRequest):
@@ -512,30 +818,59 @@ async def upload_document(request: DocumentUploadRequest):
 @app.post("/signup")
 async def signup_user(request: SignupRequest):
     """User registration"""
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-            (request.username, request.email, request.password)
+    def insert_user(hashed_password: str):
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                (request.username, request.email, hashed_password)
+            )
+            conn.commit()
+
+    if password_too_long(request.password):
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Password must be at most {MAX_PASSWORD_BYTES} bytes."}
         )
-        conn.commit()
+
+    try:
+        # bcrypt is deliberately slow, so keep it off the event loop
+        hashed_password = await asyncio.to_thread(hash_password, request.password)
+        await asyncio.get_event_loop().run_in_executor(None, insert_user, hashed_password)
         return {"message": "User registered successfully."}
     except sqlite3.IntegrityError:
         return JSONResponse(status_code=400, content={"error": "Username or email already exists."})
-    finally:
-        conn.close()
 
 @app.post("/login")
 async def login_user(request: LoginRequest):
     """User login"""
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? OR email = ?", (request.login_id, request.login_id))
-    user = cursor.fetchone()
-    conn.close()
+    def fetch_user():
+        with db_manager.get_connection() as conn:
+            # Separate single-column lookups so each hits its UNIQUE index
+            return (
+                conn.execute(
+                    "SELECT id, password, username FROM users WHERE username = ? LIMIT 1",
+                    (request.login_id,)
+                ).fetchone()
+                or conn.execute(
+                    "SELECT id, password, username FROM users WHERE email = ? LIMIT 1",
+                    (request.login_id,)
+                ).fetchone()
+            )
+
+    def upgrade_password(user_id: int):
+        hashed_password = hash_password(request.password)
+        with db_manager.get_connection() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_password, user_id))
+            conn.commit()
+
+    user = await asyncio.get_event_loop().run_in_executor(None, fetch_user)
+    stored_password = user["password"] if user else None
     
-    if user and user["password"] == request.password:
+    if await asyncio.to_thread(verify_password, request.password, stored_password):
+        # Re-hash accounts created before passwords were hashed
+        if not is_bcrypt_hash(stored_password):
+            await asyncio.to_thread(upgrade_password, user["id"])
         return {"message": "Login successful", "username": user["username"]}
     else:
         return JSONResponse(status_code=401, content={"error": "Invalid username/email or password."})
@@ -549,11 +884,48 @@ async def delete_session(session_id: str):
         del rag_system.conversation_histories[session_id]
     return {"message": f"Session {session_id} cleared."}
 
+WS_OUTBOX_SIZE = 64
+WS_FLUSH_TIMEOUT = 2.0
+
+class WebSocketOutbox(asyncio.Queue):
+    """Per-connection message queue that can shed stale partial frames"""
+
+    def drop_oldest_partial(self) -> bool:
+        """Remove the oldest queued partial frame; terminal frames are never dropped"""
+        for index, message in enumerate(self._queue):
+            if json.loads(message).get("type") == "partial":
+                del self._queue[index]
+                self.task_done()
+                return True
+        return False
+
+def enqueue_message(outbox: WebSocketOutbox, message: str):
+    """Queue a message for a client, shedding the oldest partial frame if the client is falling behind"""
+    if outbox.qsize() >= WS_OUTBOX_SIZE:
+        # Partial frames carry the full response so far, so a later one supersedes them
+        outbox.drop_oldest_partial()
+    outbox.put_nowait(message)
+
+async def drain_outbox(websocket: WebSocket, outbox: WebSocketOutbox):
+    """Deliver queued messages so a slow client never stalls response generation"""
+    try:
+        while True:
+            message = await outbox.get()
+            await websocket.send_text(message)
+            outbox.task_done()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"WebSocket send failed: {str(e)}")
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """Real-time WebSocket endpoint with streaming"""
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections.add(websocket)
+    outbox = WebSocketOutbox()
+    sender = asyncio.create_task(drain_outbox(websocket, outbox))
+    disconnected = False
     
     try:
         while True:
@@ -565,20 +937,36 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             
             if stream:
                 # Send streaming response
-                async for chunk in rag_system.stream_response(query, session_id):
-                    await websocket.send_text(chunk)
+                async with aclosing(rag_system.stream_response(query, session_id)) as chunks:
+                    async for chunk in chunks:
+                        if sender.done():
+                            # Client is gone; stop generating the completion
+                            break
+                        enqueue_message(outbox, chunk)
             else:
                 # Send complete response
                 result = await rag_system.get_response(query, session_id)
-                await websocket.send_text(json.dumps(result))
+                enqueue_message(outbox, json.dumps(result))
+            
+            if sender.done():
+                disconnected = True
+                logger.info(f"WebSocket send side closed for session {session_id}")
+                break
                 
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        disconnected = True
         logger.info(f"WebSocket disconnected for session {session_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+    finally:
+        if not disconnected and not sender.done():
+            # Give queued frames (e.g. the final "complete") a chance to go out
+            try:
+                await asyncio.wait_for(outbox.join(), timeout=WS_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropped undelivered WebSocket messages for session {session_id}")
+        sender.cancel()
+        active_connections.discard(websocket)
 
 @app.get("/debug/context")
 async def debug_context(query: str):
@@ -596,6 +984,15 @@ async def startup_event():
     logger.info(f"Active model: gpt-3.5-turbo")
     logger.info("Real-time streaming enabled")
     rag_system.log_vectorstore_stats()
+    # Warm caches in the background; /ready flips once this finishes
+    app.state.warmup_task = asyncio.create_task(rag_system.warmup())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    db_manager.close()
+    await http_async_client.aclose()
+    http_client.close()
+    logger.info("Budger AI Assistant shut down")
 
 if __name__ == "__main__":
     import uvicorn
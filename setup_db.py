@@ -27,6 +27,12 @@ CREATE TABLE IF NOT EXISTS chat_history (
 )
 """)
 
+# Chat History Index
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS idx_chat_user_sess
+ON chat_history(user_id, session_id, timestamp DESC)
+""")
+
 conn.commit()
 conn.close()
 print("Database setup complete.")